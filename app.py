@@ -9,6 +9,11 @@ import librosa.display
 
 from db import init_db
 from recognize import recognize, T_RECORD, SR, TEMP_FOLDER, TEMP_PATH
+from ingest_log import Compactor
+from snapshot import load_snapshot
+
+#CONSTANTS
+SNAPSHOT_PATH = os.environ.get('RECHORD_SNAPSHOT') # serve from this snapshot file instead of the DB
 
 st.set_page_config(
     page_title="Re:Chord",
@@ -16,6 +21,20 @@ st.set_page_config(
     layout="centered"
 )
 
+# One background merger per server process (survives reruns)
+@st.cache_resource
+def start_compactor():
+    compactor = Compactor()
+    compactor.start()
+    return compactor
+
+
+# Snapshot mapped once per server process, shared read-only by all sessions
+@st.cache_resource
+def load_catalog():
+    return load_snapshot(SNAPSHOT_PATH)
+
+
 def show_recognition_tab():
     st.subheader("Record Audio")
 
@@ -47,9 +66,12 @@ def show_recognition_tab():
             recording = sd.rec(int(T_RECORD * SR), samplerate=SR, channels=1)
             sd.wait()
             sf.write(TEMP_PATH, recording, SR)
-            conn = init_db()
-            title, score, recommendations, url = recognize(conn, TEMP_PATH)
-            conn.close()
+            if SNAPSHOT_PATH:
+                title, score, recommendations, url = recognize(load_catalog(), TEMP_PATH)
+            else:
+                conn = init_db()
+                title, score, recommendations, url = recognize(conn, TEMP_PATH)
+                conn.close()
             if title:
                 audio_data, _ = librosa.load(TEMP_PATH, sr=SR)
                 st.session_state['result'] = (TEMP_PATH, audio_data, title, score, recommendations, url)
@@ -228,6 +250,9 @@ if __name__ == "__main__":
 
     if 'db_initialized' not in st.session_state:
         st.session_state.db_initialized = False
+
+    if not SNAPSHOT_PATH: # a snapshot is read-only, nothing to merge
+        start_compactor()
     
     tab_recognition, tab_help, tab_about = st.tabs(["Music Recognition", "Help", "About"])
     
@@ -0,0 +1,336 @@
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import statistics
+
+from db import init_db, get_db_path, get_song_id_by_title
+from snapshot import export_snapshot, import_snapshot, load_snapshot
+from bloom import get_bloom, get_bloom_path, rebuild_bloom
+from ingest_log import get_segments
+
+#CONSTANTS
+N_RUNS = 5
+N_QUERIES = 50
+CLIP_LEN = 5.0 # seconds
+KEEP_RATIO = 0.3 # share of the song's hashes that survive mic + room noise
+SESSION_STEP = 2.5 # seconds between overlapping recordings of one live session
+N_SESSIONS = 5
+NOISE_RATIO = 3.0 # spurious hashes per surviving hash
+SEED = 0
+
+
+def _file_size(path):
+    total = 0
+    for p in (path,path + '-wal',path + '-shm'):
+        if os.path.exists(p):
+            total += os.path.getsize(p)
+    return total
+
+
+def _random_hash():
+    return f"{random.randint(0,2048)}|{random.randint(0,2048)}|{random.randint(0,200)/100:.2f}"
+
+
+# Simulated recordings cut from stored postings (Return [(song_id, hashes)])
+def make_queries(conn,n = N_QUERIES,clip_len = CLIP_LEN,keep = KEEP_RATIO,noise = NOISE_RATIO):
+    cur = conn.cursor()
+    song_ids = [r[0] for r in cur.execute('SELECT song_id FROM songs')]
+    random.seed(SEED)
+    queries = []
+
+    for _ in range(n):
+        song_id = random.choice(song_ids)
+        end = cur.execute('SELECT MAX(offset) FROM fingerprints WHERE song_id = ?',(song_id,)).fetchone()[0]
+        if end is None:
+            continue
+        start = random.uniform(0,max(0.0,end - clip_len))
+        cur.execute('''
+                    SELECT hash, offset FROM fingerprints
+                    WHERE song_id = ? AND offset BETWEEN ? AND ?
+                    ''',(song_id,start,start + clip_len))
+        hashes = [(h,offset - start) for h,offset in cur.fetchall() if random.random() < keep]
+        hashes += [(_random_hash(),random.uniform(0,clip_len)) for _ in range(int(len(hashes)*noise))]
+        random.shuffle(hashes)
+        queries.append((song_id,hashes))
+
+    return queries
+
+
+# Live sessions: overlapping recordings while one song keeps playing (Return [(song_id, hashes)])
+def make_session_queries(conn,n_sessions = N_SESSIONS,per_session = N_QUERIES // N_SESSIONS,
+                         clip_len = CLIP_LEN,step = SESSION_STEP,keep = KEEP_RATIO,noise = NOISE_RATIO):
+    cur = conn.cursor()
+    song_ids = [r[0] for r in cur.execute('SELECT song_id FROM songs')]
+    random.seed(SEED)
+    queries = []
+
+    for _ in range(n_sessions):
+        song_id = random.choice(song_ids)
+        cur.execute('SELECT hash, offset FROM fingerprints WHERE song_id = ? ORDER BY offset',(song_id,))
+        song = cur.fetchall()
+        if not song:
+            continue
+        start = random.uniform(0,max(0.0,song[-1][1] - clip_len - step*per_session))
+        for k in range(per_session):
+            a = start + k*step
+            hashes = [(h,offset - a) for h,offset in song
+                      if a <= offset <= a + clip_len and random.random() < keep]
+            hashes += [(_random_hash(),random.uniform(0,clip_len)) for _ in range(int(len(hashes)*noise))]
+            random.shuffle(hashes)
+            queries.append((song_id,hashes))
+
+    return queries
+
+
+# Queries from recorded clips named after their song (Return [(song_id, hashes)])
+def load_clip_queries(conn,paths):
+    from fingerprint import fingerprint
+
+    queries = []
+    for path in paths:
+        title = os.path.splitext(os.path.basename(path))[0]
+        queries.append((get_song_id_by_title(conn,title),fingerprint(path)))
+
+    return queries
+
+
+def _percentile(values,q):
+    values = sorted(values)
+    return values[min(len(values)-1,int(round(q*(len(values)-1))))]
+
+
+def _report(name,times):
+    times = sorted(times)
+    print(f"{name:<28} median {statistics.median(times)*1000:9.2f} ms   min {times[0]*1000:9.2f} ms")
+
+
+# Node cold start until the first answers: copy the DB, import a snapshot, or serve from the snapshot
+def bench_snapshot(snapshot_path = None,n = N_QUERIES,runs = N_RUNS):
+    from recognize import find_best_match, release_cache
+    from ingest_log import release_segments
+
+    conn = init_db()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)') # whole catalog in the .db file, ready to copy
+    queries = make_queries(conn,n)
+    hashes = [h for _,h in queries]
+    db_size = _file_size(get_db_path())
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    if snapshot_path is None:
+        snapshot_path = os.path.join(tmp_dir.name,'catalog.rcs')
+        t0 = time.perf_counter()
+        export_snapshot(conn,snapshot_path)
+        print(f"Export took {time.perf_counter()-t0:.2f} s")
+    conn.close()
+
+    # Fresh DB file per run: no warm posting cache or bloom filter carried over
+    def sqlite_start(run,prepare):
+        db_path = os.path.join(tmp_dir.name,f'run{run}',os.path.basename(get_db_path()))
+        os.makedirs(os.path.dirname(db_path))
+        t0 = time.perf_counter()
+        conn = prepare(db_path)
+        for query in hashes:
+            find_best_match(conn,query)
+        elapsed = time.perf_counter() - t0
+        release_cache(conn)
+        release_segments(conn)
+        conn.close()
+        return elapsed
+
+    def copy_db(db_path):
+        shutil.copyfile(get_db_path(),db_path)
+        if os.path.exists(get_bloom_path()):
+            shutil.copyfile(get_bloom_path(),get_bloom_path(db_path))
+        return init_db(db_path)
+
+    def import_db(db_path):
+        conn = init_db(db_path)
+        import_snapshot(conn,snapshot_path,verify = True)
+        return conn
+
+    copy_times, import_times, snap_times, snap_noverify_times = [],[],[],[]
+    for run in range(runs):
+        copy_times.append(sqlite_start(2*run,copy_db))
+        import_times.append(sqlite_start(2*run + 1,import_db))
+
+        for verify,out in ((True,snap_times),(False,snap_noverify_times)):
+            t0 = time.perf_counter()
+            snap = load_snapshot(snapshot_path,verify = verify)
+            for query in hashes:
+                find_best_match(snap,query)
+            out.append(time.perf_counter() - t0)
+            snap.close()
+
+    print(f"Queries: {len(queries)}   runs: {runs}")
+    print(f"DB size:       {db_size:>12} bytes")
+    print(f"Snapshot size: {os.path.getsize(snapshot_path):>12} bytes")
+    _report("DB copy + queries",copy_times)
+    _report("Snapshot import + queries",import_times)
+    _report("Snapshot load + queries",snap_times)
+    _report("  (checksum skipped)",snap_noverify_times)
+    print("Note: timings include the OS page cache; drop caches between runs for true cold start.")
+
+    tmp_dir.cleanup()
+
+
+# Full vs progressive matching: latency, accuracy, skipped lookups
+def bench_progressive(clips = None,n = N_QUERIES):
+    from recognize import find_best_match, find_best_match_progressive, get_cache
+
+    conn = init_db()
+    queries = load_clip_queries(conn,clips) if clips else make_queries(conn,n)
+
+    full_times, prog_times = [],[]
+    full_ok = prog_ok = agree = 0
+    skipped = absent = total = 0
+
+    # Both modes start from an empty posting cache, else the second one reads the first one's postings
+    cache,_ = get_cache(conn,get_segments(conn))
+    for song_id,hashes in queries:
+        cache.invalidate()
+        t0 = time.perf_counter()
+        full_id,_ = find_best_match(conn,hashes)
+        full_times.append(time.perf_counter() - t0)
+
+        cache.invalidate()
+        t0 = time.perf_counter()
+        prog_id,_,n_skipped,n_absent = find_best_match_progressive(conn,hashes)
+        prog_times.append(time.perf_counter() - t0)
+
+        full_ok += full_id == song_id
+        prog_ok += prog_id == song_id
+        agree += full_id == prog_id
+        skipped += n_skipped
+        absent += n_absent
+        total += len(hashes)
+
+    conn.close()
+    if not queries:
+        print("No queries.")
+        return
+
+    n = len(queries)
+    print(f"Queries: {n}   hashes/query: {total/n:.0f}")
+    print(f"{'mode':<12}{'mean ms':>10}{'p95 ms':>10}{'accuracy':>10}")
+    for name,times,ok in (('full',full_times,full_ok),('progressive',prog_times,prog_ok)):
+        print(f"{name:<12}{statistics.mean(times)*1000:>10.2f}{_percentile(times,0.95)*1000:>10.2f}{ok/n:>10.1%}")
+    print(f"Same answer: {agree}/{n}   lookups skipped by early stop: {skipped/total:.1%}"
+          f"   hashes not in catalog: {absent/total:.1%}")
+
+
+# Bloom filter: size, measured false positive rate, lookups avoided
+def bench_bloom(clips = None,n = N_QUERIES):
+    conn = init_db()
+    bloom = get_bloom(conn)
+    if bloom is None:
+        bloom = rebuild_bloom(conn)
+    queries = load_clip_queries(conn,clips) if clips else make_queries(conn,n)
+    cur = conn.cursor()
+    segments = get_segments(conn)
+
+    total = rejected = absent = false_pos = 0
+    filter_time = probe_time = 0.0
+
+    for _,hashes in queries:
+        unique = {h for h,_ in hashes}
+        t0 = time.perf_counter()
+        passed = {h for h in unique if h in bloom}
+        filter_time += time.perf_counter() - t0
+
+        # Index probes the filter saved
+        t0 = time.perf_counter()
+        for h in unique - passed:
+            cur.execute('SELECT song_id, offset FROM fingerprints WHERE hash = ?',(h,))
+            cur.fetchall()
+        probe_time += time.perf_counter() - t0
+        # Ground truth for the hashes let through
+        present = {h for h in passed
+                   if cur.execute('SELECT 1 FROM fingerprints WHERE hash = ? LIMIT 1',(h,)).fetchone()
+                   or segments.count(h)}
+
+        total += len(unique)
+        rejected += len(unique) - len(passed)
+        absent += len(unique) - len(present)
+        false_pos += len(passed) - len(present)
+
+    conn.close()
+    if not total:
+        print("No queries.")
+        return
+
+    print(f"Queries: {len(queries)}   unique hashes: {total}")
+    print(f"Filter: {bloom.size_bytes()} bytes, {bloom.n} hashes, k = {bloom.k}")
+    print(f"Lookups avoided: {rejected}/{total} ({rejected/total:.1%})")
+    print(f"False positive rate: {false_pos/max(1,absent):.3%} measured, {bloom.expected_fp_rate():.3%} expected")
+    print(f"Filter checks: {filter_time*1000:.1f} ms   index probes saved: {probe_time*1000:.1f} ms")
+
+
+# Repeated overlapping queries with and without the posting cache
+def bench_cache(n_sessions = N_SESSIONS,per_session = N_QUERIES // N_SESSIONS):
+    from recognize import find_best_match, get_cache
+
+    conn = init_db()
+    queries = make_session_queries(conn,n_sessions,per_session)
+    if not queries:
+        print("No queries.")
+        return
+    cache,_ = get_cache(conn,get_segments(conn))
+
+    results = {}
+    for mode in ('no cache','LRU cache'):
+        cache.invalidate()
+        cache.hits = cache.misses = cache.evictions = 0
+        times, ok = [],0
+        for song_id,hashes in queries:
+            if mode == 'no cache':
+                cache.invalidate()
+            t0 = time.perf_counter()
+            found,_ = find_best_match(conn,hashes)
+            times.append(time.perf_counter() - t0)
+            ok += found == song_id
+        results[mode] = (times,ok,cache.stats())
+    conn.close()
+
+    n = len(queries)
+    print(f"Sessions: {n_sessions}   queries: {n}   step: {SESSION_STEP} s   clip: {CLIP_LEN} s")
+    print(f"{'mode':<12}{'mean ms':>10}{'p95 ms':>10}{'accuracy':>10}{'hit rate':>10}{'evictions':>11}")
+    for mode,(times,ok,stats) in results.items():
+        lookups = stats['hits'] + stats['misses']
+        print(f"{mode:<12}{statistics.mean(times)*1000:>10.2f}{_percentile(times,0.95)*1000:>10.2f}"
+              f"{ok/n:>10.1%}{stats['hits']/max(1,lookups):>10.1%}{stats['evictions']:>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re:Chord benchmarks")
+    sub = parser.add_subparsers(dest='cmd',required=True)
+
+    p_snap = sub.add_parser('snapshot',help="Node cold start: DB copy vs snapshot import vs serving from the snapshot")
+    p_snap.add_argument('--path',default=None,help="Existing snapshot (default: export a temporary one)")
+    p_snap.add_argument('-n',type=int,default=N_QUERIES,help="No. of simulated queries")
+    p_snap.add_argument('--runs',type=int,default=N_RUNS)
+
+    p_prog = sub.add_parser('progressive',help="Full vs progressive matching")
+    p_prog.add_argument('clips',nargs='*',help="Recorded clips named <song title>.wav (default: simulated)")
+    p_prog.add_argument('-n',type=int,default=N_QUERIES,help="No. of simulated queries")
+
+    p_bloom = sub.add_parser('bloom',help="Bloom filter size, false positives and lookups avoided")
+    p_bloom.add_argument('clips',nargs='*',help="Mic captures named <song title>.wav (default: simulated)")
+    p_bloom.add_argument('-n',type=int,default=N_QUERIES,help="No. of simulated queries")
+
+    p_cache = sub.add_parser('cache',help="Overlapping live-session queries with / without the posting cache")
+    p_cache.add_argument('--sessions',type=int,default=N_SESSIONS)
+    p_cache.add_argument('--per-session',type=int,default=N_QUERIES // N_SESSIONS)
+
+    args = parser.parse_args()
+
+    if args.cmd == 'snapshot':
+        bench_snapshot(args.path,n = args.n,runs = args.runs)
+    elif args.cmd == 'progressive':
+        bench_progressive(args.clips,n = args.n)
+    elif args.cmd == 'bloom':
+        bench_bloom(args.clips,n = args.n)
+    elif args.cmd == 'cache':
+        bench_cache(args.sessions,args.per_session)
@@ -0,0 +1,173 @@
+import os
+import zlib
+import math
+import struct
+import argparse
+
+from db import init_db, get_db_path, get_conn_path
+from ingest_log import get_segments
+
+#CONSTANTS
+MAGIC = b'RCBLOOM\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQ') # magic | version | k | m (bits) | n (added) | capacity
+K = 2 # probes per hash: crc32 of the hash and of its reverse (C speed, ~0.3 us per check)
+FP_RATE = 0.01 # target false positive rate at capacity (~19 bits per hash with K = 2)
+GROWTH = 2 # capacity = GROWTH x hashes when (re)built
+MIN_CAPACITY = 100000
+
+
+class BloomFilter:
+    def __init__(self,capacity,fp_rate = FP_RATE):
+        capacity = max(1,int(capacity))
+        self.capacity = capacity
+        self.k = K
+        self.m = min(2**32,max(8,math.ceil(-K*capacity / math.log(1 - fp_rate**(1/K)))))
+        self.n = 0
+        self.bits = bytearray((self.m + 7) // 8)
+        # Counters of membership tests (for reporting)
+        self.checked = 0
+        self.rejected = 0
+
+    def add(self,hash):
+        b = hash.encode('utf-8')
+        for p in (zlib.crc32(b) % self.m,zlib.crc32(b[::-1]) % self.m):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.n += 1
+
+    def add_many(self,hashes):
+        for h in hashes:
+            self.add(h)
+
+    # False: hash is certainly not in the catalog
+    def __contains__(self,hash):
+        self.checked += 1
+        b = hash.encode('utf-8')
+        bits = self.bits
+        p = zlib.crc32(b) % self.m
+        q = zlib.crc32(b[::-1]) % self.m
+        if bits[p >> 3] & (1 << (p & 7)) and bits[q >> 3] & (1 << (q & 7)):
+            return True
+        self.rejected += 1
+
+        return False
+
+    # Expected false positive rate for the hashes added so far
+    def expected_fp_rate(self):
+        return (1 - math.exp(-self.k*self.n / self.m))**self.k
+
+    def size_bytes(self):
+        return HEADER.size + len(self.bits)
+
+    def save(self,path):
+        tmp_path = path + '.tmp'
+        with open(tmp_path,'wb') as f:
+            f.write(HEADER.pack(MAGIC,VERSION,self.k,self.m,self.n,self.capacity))
+            f.write(self.bits)
+        os.replace(tmp_path,path)
+
+    @classmethod
+    def load(cls,path):
+        with open(path,'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError(f"{path} is not a bloom filter")
+
+        magic,version,k,m,n,capacity = HEADER.unpack_from(data,0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a bloom filter")
+        if version != VERSION or k != K:
+            raise ValueError(f"Unsupported bloom filter version {version}, k = {k} (expected {VERSION}, k = {K})")
+        if len(data) - HEADER.size != (m + 7) // 8:
+            raise ValueError(f"Truncated bloom filter {path}")
+
+        bloom = cls.__new__(cls)
+        bloom.capacity, bloom.m, bloom.k, bloom.n = capacity, m, k, n
+        bloom.bits = bytearray(data[HEADER.size:])
+        bloom.checked = bloom.rejected = 0
+
+        return bloom
+
+
+# Path to .bloom file (next to .db file)
+def get_bloom_path(db_path = None):
+    return os.path.splitext(db_path or get_db_path())[0] + '.bloom'
+
+
+# Build filter over all indexed and pending hashes, plus extra ones not stored yet (Return filter)
+def rebuild_bloom(conn,extra = ()):
+    extra = list(extra)
+    cur = conn.cursor()
+    n = cur.execute('SELECT COUNT(*) FROM hash_counts').fetchone()[0]
+    segments = get_segments(conn)
+    n += sum(snap.n_hashes for snap in segments.snaps) + len(extra)
+
+    bloom = BloomFilter(max(MIN_CAPACITY,n*GROWTH))
+    bloom.add_many(r[0] for r in cur.execute('SELECT hash FROM hash_counts'))
+    for snap in segments.snaps:
+        bloom.add_many(h for h,_,_ in snap.iter_postings())
+    bloom.add_many(extra)
+    bloom.save(get_bloom_path(get_conn_path(conn)))
+
+    return bloom
+
+
+# Add hashes about to be ingested, rebuild once over capacity (no usable filter yet: build one)
+# Call before the postings are committed / appended, so the filter never rejects a stored hash
+def update_bloom(conn,hashes):
+    hashes = list(hashes)
+    path = get_bloom_path(get_conn_path(conn))
+    try:
+        bloom = BloomFilter.load(path)
+    except (OSError,ValueError): # missing or outdated filter
+        return rebuild_bloom(conn,hashes)
+
+    bloom.add_many(hashes)
+    if bloom.n > bloom.capacity:
+        return rebuild_bloom(conn,hashes)
+    bloom.save(path)
+
+    return bloom
+
+
+_filters = {}
+
+
+# Filter of the DB behind conn, reloaded when the file changes (None if not built)
+def get_bloom(conn):
+    path = get_bloom_path(get_conn_path(conn))
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    cached = _filters.get(path)
+    if cached is None or cached[0] != mtime:
+        try:
+            cached = (mtime,BloomFilter.load(path))
+        except (OSError,ValueError):
+            return None
+        _filters[path] = cached
+
+    return cached[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build / inspect the bloom filter in front of the fingerprint index")
+    parser.add_argument('cmd',choices=['build','info'])
+    args = parser.parse_args()
+
+    conn = init_db()
+    if args.cmd == 'build':
+        bloom = rebuild_bloom(conn)
+    else:
+        bloom = get_bloom(conn)
+    conn.close()
+
+    if bloom is None:
+        print("No bloom filter. Run: python bloom.py build")
+    else:
+        print("Hashes: ",bloom.n," / capacity ",bloom.capacity)
+        print("Bits: ",bloom.m,"  k: ",bloom.k)
+        print("Size: ",bloom.size_bytes()," bytes")
+        print(f"Expected false positive rate: {bloom.expected_fp_rate():.3%}")
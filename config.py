@@ -0,0 +1,23 @@
+from dataclasses import dataclass, asdict, replace
+
+# All constants of the fingerprint pipeline (spectrogram -> peaks -> hashes)
+@dataclass(frozen=True)
+class FingerprintConfig:
+    sr: int = 22050
+    n_fft: int = 4096
+    hop_length: int = 512
+    n_bands: int = 5
+    amp_threshold: float = -30 # dB
+    radius: int = 10 # For Pruning
+    fan_value: int = 15 # Degree of pairing per peak
+    min_time_diff: float = 0.0 # skip too close
+    max_time_diff: float = 2.0 # skip too far
+
+    def to_dict(self):
+        return asdict(self)
+
+    def with_changes(self,**changes):
+        return replace(self,**changes)
+
+
+DEFAULT_CONFIG = FingerprintConfig()
@@ -1,5 +1,9 @@
 import os
 import sqlite3
+from collections import Counter
+
+#CONSTANTS
+CHUNK = 900 # max. bound parameters per IN (...) query
 
 # Path to .db file
 def get_db_path():
@@ -9,10 +13,11 @@ def get_db_path():
     return os.path.join(folder,'fingerprints.db')
 
 
-# Initialize DB
-def init_db():
-    conn = sqlite3.connect(get_db_path())
+# Initialize DB (default: database/fingerprints.db)
+def init_db(path = None):
+    conn = sqlite3.connect(path or get_db_path())
     cur = conn.cursor()
+    cur.execute('PRAGMA journal_mode=WAL') # readers don't wait for ingest / merge writes
     cur.execute(''' 
                 CREATE TABLE IF NOT EXISTS songs (
                     song_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -33,6 +38,27 @@ def init_db():
     cur.execute('''
                 CREATE INDEX IF NOT EXISTS idx_hash ON fingerprints(hash)
                 ''')
+    cur.execute('''
+                CREATE INDEX IF NOT EXISTS idx_song_id ON fingerprints(song_id)
+                ''')
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS hash_counts (
+                    hash TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL
+                    ) WITHOUT ROWID
+                ''')
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS catalog_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    version INTEGER NOT NULL
+                    )
+                ''')
+    cur.execute('INSERT OR IGNORE INTO catalog_version (id,version) VALUES (0,0)')
+    cur.execute('''
+                CREATE TABLE IF NOT EXISTS merged_segments (
+                    name TEXT PRIMARY KEY
+                    )
+                ''')
     cur.execute('''
                 CREATE TABLE IF NOT EXISTS tags (
                     tag_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -48,6 +74,9 @@ def init_db():
                     FOREIGN KEY (tag_id) REFERENCES tags (tag_id)
                     )
                  ''')
+    cur.execute('''
+                CREATE INDEX IF NOT EXISTS idx_song_tags_tag ON song_tags(tag_id)
+                ''')
     cur.execute('''
                 CREATE TABLE IF NOT EXISTS song_similarities (
                     song_id1 INTEGER NOT NULL,
@@ -58,21 +87,59 @@ def init_db():
                     FOREIGN KEY (song_id2) REFERENCES songs (song_id)
                     )
                  ''')
+    cur.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sim_song2 ON song_similarities(song_id2)
+                ''')
     conn.commit()
 
+    # Backfill document frequencies for DBs built before hash_counts existed
+    has_counts = cur.execute('SELECT EXISTS (SELECT 1 FROM hash_counts)').fetchone()[0]
+    has_hashes = cur.execute('SELECT EXISTS (SELECT 1 FROM fingerprints)').fetchone()[0]
+    if has_hashes and not has_counts:
+        rebuild_hash_counts(conn)
+
     return conn
 
 
-# Clear DB
-def clear_db(conn):
+# Path of the .db file behind conn
+def get_conn_path(conn):
+    for _,name,path in conn.execute('PRAGMA database_list'):
+        if name == 'main':
+            return path or None
+
+    return None
+
+
+# Clear DB, pending ingest segments included
+# (commit = False: leave the transaction open, caller commits then calls remove_merged_segments)
+def clear_db(conn,commit = True):
+    from ingest_log import retire_segments, remove_merged_segments # imports this module
+
     cur = conn.cursor()
     cur.execute('DELETE FROM fingerprints')
+    cur.execute('DELETE FROM hash_counts')
     cur.execute('DELETE FROM songs')
     cur.execute('DELETE FROM tags')
     cur.execute('DELETE FROM song_tags')
     cur.execute('DELETE FROM song_similarities')
     cur.execute("DELETE FROM sqlite_sequence WHERE name='songs';")
-    conn.commit()
+    retire_segments(conn)
+    bump_catalog_version(conn)
+    if commit:
+        conn.commit()
+        remove_merged_segments(conn,get_conn_path(conn))
+
+
+# Mark the postings as changed (call inside the writing transaction)
+def bump_catalog_version(conn):
+    conn.execute('UPDATE catalog_version SET version = version + 1 WHERE id = 0')
+
+
+# Counter changing whenever postings change (for caches)
+def get_catalog_version(conn):
+    row = conn.execute('SELECT version FROM catalog_version WHERE id = 0').fetchone()
+
+    return row[0] if row else 0
 
 
 # Add song (Return ID)
@@ -84,15 +151,78 @@ def add_song(conn,title):
     return cur.lastrowid
 
 
-# Store hashes of song
-def store_fingerprints(conn,song_id,hash_list):
-    cur = conn.cursor()
+# Add hashes of song to fingerprints and document frequencies
+def _insert_song_hashes(cur,song_id,hash_list):
     cur.executemany('''
                     INSERT INTO fingerprints (hash,song_id,offset) VALUES (?,?,?)
                     ''',[(h,song_id,offset) for h,offset in hash_list])
+    cur.executemany('''
+                    INSERT INTO hash_counts (hash,count) VALUES (?,?)
+                    ON CONFLICT (hash) DO UPDATE SET count = count + excluded.count
+                    ''',Counter(h for h,_ in hash_list).items())
+
+
+# Store hashes of song
+def store_fingerprints(conn,song_id,hash_list):
+    cur = conn.cursor()
+    _insert_song_hashes(cur,song_id,hash_list)
+    bump_catalog_version(conn)
     conn.commit()
 
 
+# Subtract hashes of song from document frequencies
+def _uncount_song_hashes(cur,song_id):
+    cur.execute('SELECT hash, COUNT(*) FROM fingerprints WHERE song_id = ? GROUP BY hash',(song_id,))
+    rows = cur.fetchall()
+    cur.executemany('UPDATE hash_counts SET count = count - ? WHERE hash = ?',[(n,h) for h,n in rows])
+    cur.execute('DELETE FROM hash_counts WHERE count <= 0')
+
+
+# Swap old hashes of song for new ones in one transaction (Return no. of old hashes)
+def replace_fingerprints(conn,song_id,hash_list):
+    cur = conn.cursor()
+    try:
+        _uncount_song_hashes(cur,song_id)
+        cur.execute('DELETE FROM fingerprints WHERE song_id = ?',(song_id,))
+        n = cur.rowcount
+        _insert_song_hashes(cur,song_id,hash_list)
+        bump_catalog_version(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback() # queries keep seeing the old hashes
+        raise
+
+    return n
+
+
+# Recount document frequencies from fingerprints
+def rebuild_hash_counts(conn,commit = True):
+    cur = conn.cursor()
+    cur.execute('DELETE FROM hash_counts')
+    cur.execute('''
+                INSERT INTO hash_counts (hash,count)
+                SELECT hash, COUNT(*) FROM fingerprints GROUP BY hash
+                ''')
+    bump_catalog_version(conn)
+    if commit:
+        conn.commit()
+
+
+# Get no. of postings per hash (absent hashes left out)
+def get_hash_counts(conn,hashes):
+    cur = conn.cursor()
+    hashes = list(hashes)
+    counts = {}
+
+    for i in range(0,len(hashes),CHUNK):
+        chunk = hashes[i:i+CHUNK]
+        temp = ','.join('?' for _ in chunk)
+        cur.execute(f'SELECT hash, count FROM hash_counts WHERE hash IN ({temp})',chunk)
+        counts.update(cur.fetchall())
+
+    return counts
+
+
 # Find song matching hash
 def query_hashes(conn,hashes): 
     cur = conn.cursor()
@@ -108,6 +238,22 @@ def query_hashes(conn,hashes):
     return cur.fetchall()
 
 
+# Find (song_id, offset) for many hashes (Return {hash: [(song_id, offset)]})
+def query_postings(conn,hashes):
+    cur = conn.cursor()
+    hashes = list(hashes)
+    postings = {}
+
+    for i in range(0,len(hashes),CHUNK):
+        chunk = hashes[i:i+CHUNK]
+        temp = ','.join('?' for _ in chunk)
+        cur.execute(f'SELECT hash, song_id, offset FROM fingerprints WHERE hash IN ({temp})',chunk)
+        for h,song_id,offset in cur.fetchall():
+            postings.setdefault(h,[]).append((song_id,offset))
+
+    return postings
+
+
 # Add tag (Return ID)
 def add_tag(conn,name):
     cur = conn.cursor()
@@ -124,6 +270,13 @@ def add_song_tag(conn,song_id,tag_id):
     conn.commit()
 
 
+# Unlink all tags of song
+def remove_song_tags(conn,song_id):
+    cur = conn.cursor()
+    cur.execute('DELETE FROM song_tags WHERE song_id = ?',(song_id,))
+    conn.commit()
+
+
 # Get ID for song title
 def get_song_id_by_title(conn,title):
     cur = conn.cursor()
@@ -146,6 +299,35 @@ def get_song_tags(conn,song_id):
     return [r[0] for r in cur.fetchall()]
 
 
+# Get songs sharing tags with song (Return [(song_id, shared)])
+def get_tag_neighbors(conn,song_id):
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT st2.song_id, COUNT(*)
+                FROM song_tags AS st1
+                JOIN song_tags AS st2 ON st1.tag_id = st2.tag_id
+                WHERE st1.song_id = ? AND st2.song_id != st1.song_id
+                GROUP BY st2.song_id
+                ''',(song_id,))
+
+    return cur.fetchall()
+
+
+# Get songs listing song as similar
+def get_similar_referrers(conn,song_id):
+    cur = conn.cursor()
+    cur.execute('SELECT song_id1 FROM song_similarities WHERE song_id2 = ?',(song_id,))
+
+    return [r[0] for r in cur.fetchall()]
+
+
+# Drop similarity list of song
+def clear_song_similarities(conn,song_id):
+    cur = conn.cursor()
+    cur.execute('DELETE FROM song_similarities WHERE song_id1 = ?',(song_id,))
+    conn.commit()
+
+
 # Store similarity score between two songs
 def store_song_similarity(conn,id1,id2,score):
     cur = conn.cursor()
@@ -170,6 +352,34 @@ def get_top_similar_songs(conn, song_id, limit = 5):
     return cur.fetchall()
 
 
+# Delete song with its hashes, tags and similarities
+def remove_song(conn,song_id):
+    cur = conn.cursor()
+    _uncount_song_hashes(cur,song_id)
+    cur.execute('DELETE FROM fingerprints WHERE song_id = ?',(song_id,))
+    cur.execute('DELETE FROM song_tags WHERE song_id = ?',(song_id,))
+    cur.execute('DELETE FROM song_similarities WHERE song_id1 = ? OR song_id2 = ?',(song_id,song_id))
+    cur.execute('DELETE FROM songs WHERE song_id = ?',(song_id,))
+    bump_catalog_version(conn)
+    conn.commit()
+
+
+# VACUUM once enough pages are free (Return True if vacuumed)
+def compact_db(conn,min_free_ratio = 0.25):
+    cur = conn.cursor()
+    page_count = cur.execute('PRAGMA page_count').fetchone()[0]
+    free_count = cur.execute('PRAGMA freelist_count').fetchone()[0]
+
+    if page_count == 0 or free_count / page_count < min_free_ratio:
+        return False
+
+    conn.commit()
+    cur.execute('VACUUM')
+    cur.execute('PRAGMA optimize')
+
+    return True
+
+
 if __name__ == "__main__":
     conn = init_db()
     print("Database ready.")
@@ -1,17 +1,16 @@
 import argparse
-from visualize import SR,N_FFT, HOP_LENGTH, load_audio, get_spectrogram, find_peaks, prune 
+from config import DEFAULT_CONFIG
+from visualize import load_audio, get_audio_duration, get_spectrogram, find_peaks, prune 
 
-#CONSTANTS
-FAN_VALUE = 15 # Degree of pairing per peak
-MIN_TIME_DIFF = 0.0 # skip too close
-MAX_TIME_DIFF = 2.0 # skip too far
+#CONSTANTS (fingerprint parameters: see config.py)
+BLOCK_SEC = 60.0 # decode long recordings in blocks of this length
 
-def create_hash(peaks):
+def create_hash(peaks,config = DEFAULT_CONFIG):
     sorted_peaks = sorted(peaks,key = lambda p : p[1])
     f_bins = [p[0] for p in sorted_peaks]
     t_idxs = [p[1] for p in sorted_peaks]
 
-    t_sec = [idx* HOP_LENGTH/SR for idx in t_idxs]
+    t_sec = [idx* config.hop_length/config.sr for idx in t_idxs]
 
     hashes = []
     n = len(peaks)
@@ -20,33 +19,53 @@ def create_hash(peaks):
         f1 = f_bins[i]
         t1 = t_sec[i]
         c = 0
-        upper = min(n, i+1+FAN_VALUE*2) # limit of search
+        upper = min(n, i+1+config.fan_value*2) # limit of search
 
         for j in range(i+1, upper):
             f2 = f_bins[j]
             t2 = t_sec[j]
             dt = t2 - t1
-            if dt < MIN_TIME_DIFF:
+            if dt < config.min_time_diff:
                 continue
-            if dt > MAX_TIME_DIFF:
+            if dt > config.max_time_diff:
                 break
 
             hash = f"{f1}|{f2}|{dt:.2f}"
             hashes.append((hash,t1))
             c+=1
-            if c>=FAN_VALUE:
+            if c>=config.fan_value:
                 break
 
     return hashes
 
 
-def fingerprint(audio_path):
-    y,sr = load_audio(audio_path)
-    S_db, freqs, times = get_spectrogram(y,sr)
-    peaks = find_peaks(S_db,freqs)
-    final = prune(peaks,S_db)
+# Hashes of decoded audio (samples at config.sr)
+def fingerprint_audio(y,sr,config = DEFAULT_CONFIG):
+    S_db, freqs, times = get_spectrogram(y,sr,config)
+    peaks = find_peaks(S_db,freqs,config)
+    final = prune(peaks,S_db,config)
 
-    return create_hash(final)
+    return create_hash(final,config)
+
+
+def fingerprint(audio_path,config = DEFAULT_CONFIG):
+    y,sr = load_audio(audio_path,config)
+
+    return fingerprint_audio(y,sr,config)
+
+
+# Hashes of a long recording, one list per block (times relative to recording start)
+# Each block is decoded with a small tail so pairs crossing the block edge are kept;
+# hashes anchored in the tail belong to the next block
+def fingerprint_blocks(audio_path,config = DEFAULT_CONFIG,block_sec = BLOCK_SEC):
+    total = get_audio_duration(audio_path)
+    margin = config.max_time_diff + config.n_fft/config.sr
+    start = 0.0
+
+    while start < total:
+        y,sr = load_audio(audio_path,config,offset = start,duration = block_sec + margin)
+        yield [(h,start + t) for h,t in fingerprint_audio(y,sr,config) if t < block_sec]
+        start += block_sec
 
 
 if __name__ == "__main__":
@@ -0,0 +1,260 @@
+import os
+import time
+import logging
+import argparse
+import threading
+from collections import Counter
+
+from db import init_db, get_db_path, get_conn_path, bump_catalog_version
+from snapshot import write_postings, load_snapshot, SNAPSHOT_EXT
+
+#CONSTANTS
+SEGMENTS_FOLDER = 'segments'
+MAX_SEGMENTS = 8 # merge once this many segments are pending
+MAX_SEGMENT_AGE = 300 # seconds, merge older segments even if few
+COMPACT_INTERVAL = 10 # seconds between compactor checks
+
+log = logging.getLogger(__name__)
+
+
+# Path to segments folder (next to .db file)
+def get_segments_path(db_path = None):
+    folder = os.path.join(os.path.dirname(db_path or get_db_path()),SEGMENTS_FOLDER)
+    os.makedirs(folder,exist_ok=True)
+
+    return folder
+
+
+# Pending segment file names, oldest first
+def list_segments(db_path = None):
+    folder = get_segments_path(db_path)
+    return sorted(f for f in os.listdir(folder) if f.endswith(SNAPSHOT_EXT))
+
+
+def _merged_names(conn,names):
+    if not names:
+        return set()
+    temp = ','.join('?' for _ in names)
+    cur = conn.execute(f'SELECT name FROM merged_segments WHERE name IN ({temp})',names)
+
+    return {r[0] for r in cur.fetchall()}
+
+
+# Write postings [(hash, song_id, offset)] as a new immutable segment (Return file name)
+def append_segment(postings,db_path = None):
+    postings = sorted(postings)
+    name = f"seg-{time.time_ns():020d}{SNAPSHOT_EXT}"
+    write_postings(os.path.join(get_segments_path(db_path),name),postings,
+                   meta = {'song_ids' : sorted({p[1] for p in postings})})
+
+    return name
+
+
+# Read-only view of the pending segments
+class SegmentSet:
+    def __init__(self,db_path = None):
+        self.db_path = db_path
+        self.snaps = ()
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    # Pick up new segments, drop merged ones
+    def refresh(self,conn):
+        folder = get_segments_path(self.db_path)
+        names = list_segments(self.db_path)
+        if not names and not self.snaps:
+            return self
+
+        merged = _merged_names(conn,names)
+        live = tuple(n for n in names if n not in merged)
+        if live == self._stamp:
+            return self
+
+        with self._lock:
+            opened = {os.path.basename(s.path) : s for s in self.snaps}
+            snaps = []
+            for name in live:
+                snap = opened.get(name)
+                if snap is None:
+                    try:
+                        snap = load_snapshot(os.path.join(folder,name))
+                    except (OSError,ValueError): # removed by compactor meanwhile
+                        continue
+                snaps.append(snap)
+            # Old snapshots are only dropped, never closed: queries may still hold them
+            self.snaps = tuple(snaps)
+            self._stamp = live
+
+        return self
+
+    # Find (song_id, offset) for hash
+    def lookup(self,hash):
+        found = []
+        for snap in self.snaps:
+            found += snap.lookup(hash)
+        return found
+
+    # No. of postings for hash
+    def count(self,hash):
+        return sum(snap.count(hash) for snap in self.snaps)
+
+    def __len__(self):
+        return len(self.snaps)
+
+
+_segment_sets = {}
+
+
+# Shared segment view of this process, up to date with the folder
+def get_segments(conn):
+    db_path = get_conn_path(conn) or get_db_path()
+    segments = _segment_sets.get(db_path)
+    if segments is None:
+        segments = _segment_sets.setdefault(db_path,SegmentSet(db_path))
+
+    return segments.refresh(conn)
+
+
+# Forget the segment view of the DB behind conn (e.g. before deleting a temporary DB)
+def release_segments(conn):
+    _segment_sets.pop(get_conn_path(conn) or get_db_path(),None)
+
+
+# Move all pending segments into the main index (Return no. of postings merged)
+def merge_segments(conn):
+    db_path = get_conn_path(conn)
+    folder = get_segments_path(db_path)
+
+    n = 0
+    for name in list_segments(db_path):
+        n += _merge_segment(conn,folder,name)
+    remove_merged_segments(conn,db_path)
+
+    return n
+
+
+# One segment per transaction: short write locks, memory bounded by one segment
+# (Return no. of postings merged, 0 if skipped)
+def _merge_segment(conn,folder,name):
+    try:
+        snap = load_snapshot(os.path.join(folder,name)) # checksum checked before taking the lock
+    except ValueError: # corrupt segment, leave it for inspection
+        log.warning("Skipping unreadable segment %s",name)
+        return 0
+    except OSError: # removed by another merger meanwhile
+        return 0
+
+    # Take the write lock before reading merged_segments so concurrent mergers
+    # (app compactor, --watch, manage_songs, snapshot export) see each other's work
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+
+    counts = Counter()
+    try:
+        # Merged meanwhile: still recorded, or already removed with its record pruned
+        if _merged_names(conn,[name]) or not os.path.exists(os.path.join(folder,name)):
+            conn.commit()
+            return 0
+
+        cur = conn.cursor()
+        known = {r[0] for r in cur.execute('SELECT song_id FROM songs')}
+
+        def rows():
+            for row in snap.iter_postings():
+                if row[1] in known:
+                    counts[row[0]] += 1
+                    yield row
+
+        # One transaction: postings, counts and the merge record land together
+        cur.executemany('INSERT INTO fingerprints (hash,song_id,offset) VALUES (?,?,?)',rows())
+        cur.executemany('''
+                        INSERT INTO hash_counts (hash,count) VALUES (?,?)
+                        ON CONFLICT (hash) DO UPDATE SET count = count + excluded.count
+                        ''',counts.items())
+        cur.execute('INSERT OR IGNORE INTO merged_segments (name) VALUES (?)',(name,))
+        bump_catalog_version(conn)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        snap.close()
+
+    return sum(counts.values())
+
+
+# Delete files of merged segments, then forget their names
+# Files go last; one still mapped by a reader (Windows) is retried next time
+def remove_merged_segments(conn,db_path = None):
+    folder = get_segments_path(db_path)
+    for (name,) in conn.execute('SELECT name FROM merged_segments').fetchall():
+        try:
+            os.remove(os.path.join(folder,name))
+        except OSError:
+            pass
+
+    remaining = set(list_segments(db_path))
+    stale = [r for r in conn.execute('SELECT name FROM merged_segments') if r[0] not in remaining]
+    conn.executemany('DELETE FROM merged_segments WHERE name = ?',stale)
+    conn.commit()
+
+
+# Merge when enough segments are pending or the oldest is too old
+def needs_merge(db_path = None,max_segments = MAX_SEGMENTS,max_age = MAX_SEGMENT_AGE):
+    names = list_segments(db_path)
+    if not names:
+        return False
+    if len(names) >= max_segments:
+        return True
+    oldest = os.path.getmtime(os.path.join(get_segments_path(db_path),names[0]))
+
+    return time.time() - oldest >= max_age
+
+
+# Background thread merging segments into the main index
+class Compactor(threading.Thread):
+    def __init__(self,interval = COMPACT_INTERVAL,db_path = None):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.db_path = db_path
+        self._stop_event = threading.Event()
+
+    def run(self):
+        conn = init_db(self.db_path) # own connection, SQLite connections stay in their thread
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    if needs_merge(self.db_path):
+                        merge_segments(conn)
+                except Exception: # e.g. DB locked by a long ingest: retry next round
+                    log.exception("Segment merge failed")
+                self._stop_event.wait(self.interval)
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge pending ingest segments into the main index")
+    parser.add_argument('--watch',action='store_true',help="Keep running and merge in the background")
+    parser.add_argument('--interval',type=float,default=COMPACT_INTERVAL)
+    args = parser.parse_args()
+
+    if args.watch:
+        compactor = Compactor(args.interval)
+        compactor.start()
+        print("Compactor running. Ctrl+C to stop.")
+        try:
+            while compactor.is_alive():
+                compactor.join(1)
+        except KeyboardInterrupt:
+            compactor.stop()
+    else:
+        conn = init_db()
+        n = merge_segments(conn)
+        conn.close()
+        print("Merged ",n," postings.")
@@ -0,0 +1,102 @@
+import os
+import argparse
+
+from db import init_db,add_song,replace_fingerprints,add_tag,add_song_tag,remove_song_tags,get_song_id_by_title,get_tag_neighbors,get_similar_referrers,remove_song,compact_db
+from ingest_log import merge_segments
+from bloom import update_bloom, rebuild_bloom
+
+#CONSTANTS
+VACUUM_RATIO = 0.25 # free pages / total pages before VACUUM
+
+
+# Songs whose similarity list can change when song changes
+def affected_songs(conn,song_id):
+    ids = {song_id}
+    ids.update(get_similar_referrers(conn,song_id))
+    ids.update(id2 for id2,_ in get_tag_neighbors(conn,song_id))
+
+    return ids
+
+
+# Delete one song and repair neighbours (Return False if unknown)
+def remove(conn,title):
+    from process_songs import update_similarities
+
+    song_id = get_song_id_by_title(conn,title)
+    if song_id is None:
+        return False
+
+    merge_segments(conn) # pending postings of the song must be in the index to be deleted
+    affected = affected_songs(conn,song_id)
+    affected.discard(song_id)
+    remove_song(conn,song_id)
+    update_similarities(conn,affected)
+
+    return True
+
+
+# Re-index one song (Return song ID)
+def replace(conn,title,audio_path,tags = None):
+    from fingerprint import fingerprint
+    from process_songs import update_similarities
+
+    hashes = fingerprint(audio_path)
+    update_bloom(conn,(h for h,_ in hashes)) # before the hashes can be queried
+    merge_segments(conn)
+
+    song_id = get_song_id_by_title(conn,title)
+    is_new = song_id is None
+    if is_new:
+        song_id = add_song(conn,title)
+    replace_fingerprints(conn,song_id,hashes) # queries never see the song without hashes
+
+    if tags is not None:
+        affected = affected_songs(conn,song_id) # neighbours through old tags
+        remove_song_tags(conn,song_id)
+        for tag in tags:
+            add_song_tag(conn,song_id,add_tag(conn,tag))
+        affected |= affected_songs(conn,song_id) # neighbours through new tags
+        update_similarities(conn,affected)
+    elif is_new:
+        update_similarities(conn,affected_songs(conn,song_id))
+
+    return song_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove or re-index single songs")
+    sub = parser.add_subparsers(dest='cmd',required=True)
+
+    p_rm = sub.add_parser('remove',help="Delete a song with its hashes, tags and similarities")
+    p_rm.add_argument('title')
+
+    p_rep = sub.add_parser('replace',help="Re-fingerprint a song (adds it if new)")
+    p_rep.add_argument('audio_path')
+    p_rep.add_argument('--title',default=None,help="Default: file name")
+    p_rep.add_argument('--tags',nargs='+',default=None,help="Replace tags of song")
+
+    p_vac = sub.add_parser('vacuum',help="Compact DB file (run from cron / scheduler)")
+    p_vac.add_argument('--force',action='store_true',help="VACUUM even if few pages are free")
+
+    args = parser.parse_args()
+    conn = init_db()
+
+    if args.cmd == 'remove':
+        if remove(conn,args.title):
+            print("Removed: ",args.title)
+        else:
+            print("Unknown song: ",args.title)
+    elif args.cmd == 'replace':
+        if not args.audio_path.lower().endswith(".mp3"):
+            print("Only .mp3 files allowed.")
+            exit(1)
+        title = args.title or os.path.splitext(os.path.basename(args.audio_path))[0]
+        song_id = replace(conn,title,args.audio_path,args.tags)
+        print("Re-indexed: ",title," ID : ",song_id)
+
+    ratio = 0.0 if args.cmd == 'vacuum' and args.force else VACUUM_RATIO
+    if compact_db(conn,min_free_ratio = ratio):
+        print("Database compacted.")
+    if args.cmd == 'vacuum':
+        rebuild_bloom(conn) # drop bits of removed songs
+    conn.close()
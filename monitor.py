@@ -0,0 +1,129 @@
+import csv
+import argparse
+from bisect import bisect_left
+from collections import Counter
+
+from config import DEFAULT_CONFIG
+from db import init_db
+from fingerprint import fingerprint_blocks
+from recognize import fetch_postings, MATCH_LIM
+
+#CONSTANTS
+WINDOW_SEC = 10.0 # length of the sliding window
+HOP_SEC = 2.0 # window step
+DIFF_TOL = 0.05 # s, windows with offsets this close continue the same segment
+
+
+# (time in recording, song_id, aligned offset) for every matching posting
+def collect_votes(conn,audio_path,config = DEFAULT_CONFIG):
+    votes = []
+    for block in fingerprint_blocks(audio_path,config):
+        postings = fetch_postings(conn,(h for h,_ in block)) # one bulk lookup per block
+        for h,t in block:
+            for song_id,song_offset in postings.get(h,()):
+                votes.append((t,song_id,round(song_offset - t,2)))
+    votes.sort()
+
+    return votes
+
+
+# Best (song_id, offset) bin of each window (Return [(start, end, bin, votes)])
+def slide_windows(votes,window = WINDOW_SEC,hop = HOP_SEC,min_votes = MATCH_LIM):
+    if not votes:
+        return []
+
+    bins = Counter()
+    lo = hi = 0
+    found = []
+    last = votes[-1][0]
+    k = 0
+
+    while k*hop <= last:
+        start = k*hop
+        stop = start + window
+        while hi < len(votes) and votes[hi][0] < stop:
+            bins[votes[hi][1:]] += 1
+            hi += 1
+        while lo < hi and votes[lo][0] < start:
+            key = votes[lo][1:]
+            bins[key] -= 1
+            if bins[key] == 0:
+                del bins[key]
+            lo += 1
+
+        if bins:
+            key,n = max(bins.items(),key = lambda kv : kv[1])
+            if n >= min_votes:
+                found.append((start,stop,key,n))
+        k += 1
+
+    return found
+
+
+# Merge overlapping windows of the same alignment into segments
+# (Return [(song_id, start, end, confidence)], confidence = peak window votes)
+def build_timeline(votes,windows):
+    times = [v[0] for v in votes]
+    segments = []
+
+    for start,stop,(song_id,diff),n in windows:
+        if segments:
+            seg = segments[-1]
+            if seg['song_id'] == song_id and abs(seg['diff'] - diff) <= DIFF_TOL and start <= seg['stop']:
+                seg['stop'] = stop
+                seg['score'] = max(seg['score'],n)
+                continue
+        segments.append({'song_id' : song_id,'diff' : diff,'start' : start,'stop' : stop,'score' : n})
+
+    timeline = []
+    for seg in segments:
+        # Tighten the window bounds to the first / last aligned vote
+        lo = bisect_left(times,seg['start'])
+        hi = bisect_left(times,seg['stop'])
+        hits = [votes[i][0] for i in range(lo,hi)
+                if votes[i][1] == seg['song_id'] and abs(votes[i][2] - seg['diff']) <= DIFF_TOL]
+        start,end = (hits[0],hits[-1]) if hits else (seg['start'],seg['stop'])
+        timeline.append((seg['song_id'],start,end,seg['score']))
+
+    return timeline
+
+
+# Identify every song in a long recording (Return [(title, start, end, confidence)])
+def monitor(conn,audio_path,window = WINDOW_SEC,hop = HOP_SEC,config = DEFAULT_CONFIG):
+    votes = collect_votes(conn,audio_path,config)
+    timeline = build_timeline(votes,slide_windows(votes,window,hop))
+
+    cur = conn.cursor()
+    titles = dict(cur.execute('SELECT song_id, title FROM songs').fetchall())
+
+    return [(titles.get(song_id),start,end,score) for song_id,start,end,score in timeline]
+
+
+def fmt_time(sec):
+    sec = int(sec)
+    return f"{sec//3600:02d}:{sec%3600//60:02d}:{sec%60:02d}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List every catalog song found in a long recording")
+    parser.add_argument("audio_path")
+    parser.add_argument("--window",type=float,default=WINDOW_SEC,help="Window length in s")
+    parser.add_argument("--hop",type=float,default=HOP_SEC,help="Window step in s")
+    parser.add_argument("--csv",default=None,help="Also write timeline to this file")
+    args = parser.parse_args()
+
+    conn = init_db()
+    timeline = monitor(conn,args.audio_path,args.window,args.hop)
+    conn.close()
+
+    for title,start,end,score in timeline:
+        print(f"{fmt_time(start)} - {fmt_time(end)}  {title}  (confidence {score})")
+    if not timeline:
+        print("No songs found.")
+
+    if args.csv:
+        with open(args.csv,'w',newline='',encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['title','start_sec','end_sec','confidence'])
+            writer.writerows(timeline)
+        print("Saved to ",args.csv)
@@ -1,14 +1,18 @@
 import os
+import argparse
 
-from db import init_db,add_song,store_fingerprints,add_tag,add_song_tag,get_song_id_by_title,get_song_tags,store_song_similarity
+from db import init_db,add_song,store_fingerprints,add_tag,add_song_tag,get_song_id_by_title,get_song_tags,store_song_similarity,get_tag_neighbors,clear_song_similarities
 
 from fingerprint import fingerprint
+from ingest_log import append_segment
+from bloom import update_bloom
 
 #CONSTANTS
 SONGS_DIR = os.path.join(os.path.dirname(__file__),'data')
 TAGS_FILE = '_songs_tags.txt'
 URLS_FILE = '_songs_url.txt'
 TOP_N = 5
+BATCH_POSTINGS = 1000000 # postings per bloom update and per ingest segment (staged mode)
 
 def parse_songs_tags(tags_path):
     songs = []
@@ -70,9 +74,32 @@ def compute_and_store_similarities(conn,song_ids):
             store_song_similarity(conn,id1,id2,count)
 
 
-def process_songs():
+# Recompute similarity lists of given songs only
+def update_similarities(conn,song_ids):
+    for id1 in song_ids:
+        similar = get_tag_neighbors(conn,id1)
+        similar.sort(key = lambda x : (-x[1],x[0]))
+
+        clear_song_similarities(conn,id1)
+        for id2, count in similar[:TOP_N]:
+            store_song_similarity(conn,id1,id2,count)
+
+
+# Publish fingerprinted songs [(song_id, hashes)]: bloom bits first, so queries never miss their hashes
+def publish_batch(conn,batch,staged):
+    update_bloom(conn,(h for _,hashes in batch for h,_ in hashes))
+    if staged: # one append-only segment, merged into the index by the compactor
+        append_segment([(h,song_id,offset) for song_id,hashes in batch for h,offset in hashes])
+    else:
+        for song_id,hashes in batch:
+            store_fingerprints(conn,song_id,hashes)
+
+
+def process_songs(staged = False):
     conn = init_db()
-    
+    batch = [] # fingerprinted, not yet published
+    n_pending = 0
+
     for fname in os.listdir(SONGS_DIR):
         if not fname.lower().endswith('.mp3'):
             continue
@@ -86,7 +113,15 @@ def process_songs():
 
         hashes = fingerprint(path)
         print("Generated ",len(hashes)," hashes")
-        store_fingerprints(conn,song_id,hashes)
+        batch.append((song_id,hashes))
+        n_pending += len(hashes)
+        if n_pending >= BATCH_POSTINGS:
+            publish_batch(conn,batch,staged)
+            batch = []
+            n_pending = 0
+
+    if batch:
+        publish_batch(conn,batch,staged)
 
     tags_path = os.path.join(SONGS_DIR,TAGS_FILE)
     songs_and_tags = parse_songs_tags(tags_path)
@@ -124,4 +159,8 @@ def process_songs():
 
 
 if __name__ == "__main__":
-    process_songs()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--staged",action="store_true",help="Write hashes to ingest segments instead of the index")
+    args = parser.parse_args()
+
+    process_songs(staged = args.staged)
\ No newline at end of file
@@ -1,27 +1,167 @@
 import os
+import threading
+from collections import OrderedDict
 import sounddevice as sd
 import soundfile as sf
 
-from db import init_db, get_top_similar_songs
+from db import init_db, get_db_path, get_conn_path, get_top_similar_songs, get_hash_counts, query_postings, get_catalog_version
+from config import DEFAULT_CONFIG
 from fingerprint import fingerprint
+from ingest_log import get_segments
+from snapshot import Snapshot
+from bloom import get_bloom
 
 #CONSTANTS
 T_RECORD = 5
-SR = 22050
+SR = DEFAULT_CONFIG.sr # recording rate, same as fingerprinting
 TEMP_FOLDER = "temp"
 TEMP_PATH = os.path.join(TEMP_FOLDER,'recorded.wav')
 MATCH_LIM = 5
 RECOMMEND_LIM = 5
+CACHE_POSTINGS = 200000 # max. postings kept by the posting cache
 
-def find_best_match(conn,hashes):
-    cur = conn.cursor()
-    matches = {}
 
-    for hash,test_offset in hashes:
+# LRU cache hash -> postings, shared by all recognitions of the process
+class PostingCache:
+    def __init__(self,max_postings = CACHE_POSTINGS):
+        self.max_postings = max_postings
+        self._entries = OrderedDict()
+        self._size = 0 # postings held (an empty list counts as 1)
+        self._token = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Drop all entries if the catalog changed since the last call (Return token, pass it to put)
+    def validate(self,token):
+        with self._lock:
+            if token != self._token:
+                self._entries.clear()
+                self._size = 0
+                self._token = token
+
+        return token
+
+    def invalidate(self):
+        self.validate(object())
+
+    # Cached postings of hash (None on miss)
+    def get(self,hash):
+        with self._lock:
+            ans = self._entries.get(hash)
+            if ans is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(hash)
+            self.hits += 1
+
+            return ans
+
+    # Store postings read under token (dropped if the catalog changed since)
+    def put(self,hash,postings,token):
+        cost = max(1,len(postings))
+        if cost > self.max_postings:
+            return
+        with self._lock:
+            if token != self._token:
+                return
+            old = self._entries.pop(hash,None)
+            if old is not None:
+                self._size -= max(1,len(old))
+            self._entries[hash] = postings
+            self._size += cost
+            while self._size > self.max_postings:
+                _,dropped = self._entries.popitem(last = False)
+                self._size -= max(1,len(dropped))
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'evictions' : self.evictions,
+            'entries' : len(self._entries),
+            'postings' : self._size,
+        }
+
+
+_caches = {}
+
+
+# Posting cache of the DB behind conn, emptied when ingest changed the catalog (Return cache, token)
+def get_cache(conn,segments):
+    path = get_conn_path(conn) or get_db_path()
+    cache = _caches.get(path)
+    if cache is None:
+        cache = _caches.setdefault(path,PostingCache())
+    token = cache.validate((get_catalog_version(conn),tuple(s.path for s in segments.snaps)))
+
+    return cache,token
+
+
+# Forget the cache of the DB behind conn (e.g. before deleting a temporary DB)
+def release_cache(conn):
+    _caches.pop(get_conn_path(conn) or get_db_path(),None)
+
+
+# Hit / miss / eviction counters of the posting cache
+def cache_stats(conn):
+    cache,_ = get_cache(conn,get_segments(conn))
+    return cache.stats()
+
+
+# Find (song_id, offset) for hash in main index and pending segments
+def get_postings(cur,segments,cache,token,hash):
+    ans = cache.get(hash)
+    if ans is None:
         cur.execute('SELECT song_id, offset FROM fingerprints WHERE hash = ?',(hash,))
         ans = cur.fetchall()
+        if segments:
+            ans += segments.lookup(hash)
+        ans = tuple(ans) # shared through the cache, keep immutable
+        cache.put(hash,ans,token)
+
+    return ans
+
+
+# Bulk version of get_postings (Return {hash: postings})
+def fetch_postings(conn,hashes):
+    hashes = set(hashes)
+    bloom = get_bloom(conn)
+    if bloom is not None:
+        hashes = {h for h in hashes if h in bloom}
+    segments = get_segments(conn)
+    cache,token = get_cache(conn,segments)
+
+    postings = {}
+    missing = []
+    for h in hashes:
+        ans = cache.get(h)
+        if ans is None:
+            missing.append(h)
+        elif ans:
+            postings[h] = ans
+
+    found = query_postings(conn,missing)
+    for h in missing:
+        ans = found.get(h,[])
+        if segments:
+            ans += segments.lookup(h)
+        ans = tuple(ans)
+        cache.put(h,ans,token)
+        if ans:
+            postings[h] = ans
+
+    return postings
 
-        for song_id,song_offset in ans:
+
+# Vote for (song, offset difference) bins, postings from lookup(hash) (Return ID, score)
+def _vote(hashes,lookup):
+    matches = {}
+
+    for hash,test_offset in hashes:
+        for song_id,song_offset in lookup(hash):
             diff = round(song_offset - test_offset,2)
             key = (song_id,diff)
             if key in matches:
@@ -42,12 +182,100 @@ def find_best_match(conn,hashes):
         return None,0
 
 
-def recognize(conn,audio_path):
-    hashes = fingerprint(audio_path)
-    song_id, score = find_best_match(conn,hashes)
+# conn: DB connection, or a Snapshot to serve straight from a snapshot file
+def find_best_match(conn,hashes):
+    if isinstance(conn,Snapshot):
+        return _vote(hashes,conn.lookup)
+
+    cur = conn.cursor()
+    segments = get_segments(conn)
+    cache,token = get_cache(conn,segments)
+    bloom = get_bloom(conn)
+
+    def lookup(hash):
+        if bloom is not None and hash not in bloom: # certainly absent, skip the index probe
+            return ()
+        return get_postings(cur,segments,cache,token,hash)
+
+    return _vote(hashes,lookup)
+
+
+# Rarest hashes first, stop once the leading (song, offset) bin can't be caught
+# Each remaining query hash adds at most one vote to any bin, so the leader is
+# final when its lead exceeds the no. of hashes left. Score counts only the votes
+# seen before stopping (Return ID, score, lookups skipped by stopping early,
+# hashes not in the catalog - these cost a count probe but no posting lookup)
+def find_best_match_progressive(conn,hashes):
+    unique = {h for h,_ in hashes}
+    if isinstance(conn,Snapshot):
+        counts = {h : conn.count(h) for h in unique}
+        counts = {h : n for h,n in counts.items() if n}
+        lookup = conn.lookup
+    else:
+        cur = conn.cursor()
+        segments = get_segments(conn)
+        cache,token = get_cache(conn,segments)
+        bloom = get_bloom(conn)
+        if bloom is not None:
+            unique = {h for h in unique if h in bloom}
+        counts = get_hash_counts(conn,unique)
+        if segments:
+            for h in unique:
+                n = segments.count(h)
+                if n:
+                    counts[h] = counts.get(h,0) + n
+        lookup = lambda h : get_postings(cur,segments,cache,token,h)
+
+    # Hashes absent from the catalog can't vote: no lookup needed
+    todo = sorted((e for e in hashes if e[0] in counts), key = lambda e : counts[e[0]])
+    absent = len(hashes) - len(todo)
+
+    matches = {}
+    best_key, best, second = None, 0, 0
+    remaining = len(todo)
+
+    for hash,test_offset in todo:
+        remaining -= 1
+
+        for song_id,song_offset in lookup(hash):
+            diff = round(song_offset - test_offset,2)
+            key = (song_id,diff)
+            votes = matches.get(key,0) + 1
+            matches[key] = votes
+
+            if key == best_key:
+                best = votes
+            elif votes > best:
+                second = best
+                best_key, best = key, votes
+            elif votes > second:
+                second = votes
+
+        if best + remaining < MATCH_LIM: # no bin can reach the limit anymore
+            break
+        if best >= MATCH_LIM and best - second > remaining:
+            break
+
+    if best_key is None or best < MATCH_LIM:
+        return None,0,remaining,absent
+
+    return best_key[0],best,remaining,absent
+
+
+# conn: DB connection or Snapshot (see find_best_match)
+def recognize(conn,audio_path,progressive = False,config = DEFAULT_CONFIG):
+    hashes = fingerprint(audio_path,config)
+    if progressive:
+        song_id, score, _, _ = find_best_match_progressive(conn,hashes)
+    else:
+        song_id, score = find_best_match(conn,hashes)
 
     if song_id is None:
         return None,0,None,""
+
+    if isinstance(conn,Snapshot):
+        title,url = conn.songs.get(song_id,(None,None))
+        return title,score,conn.get_top_similar_songs(song_id,limit = RECOMMEND_LIM),url
     
     cur = conn.cursor()
     cur.execute('SELECT title,url FROM songs WHERE song_id = ?',(song_id,))
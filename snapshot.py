@@ -0,0 +1,307 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import argparse
+import hashlib
+from array import array
+from bisect import bisect_left
+
+from db import init_db, get_conn_path, clear_db, rebuild_hash_counts
+
+#CONSTANTS
+MAGIC = b'RCSNAP\x00\x00'
+VERSION = 1
+N_SECTIONS = 6 # meta, key offsets, keys, posting starts, posting songs, posting offsets
+HEADER = struct.Struct('<8sIIQQ' + 'QQ'*N_SECTIONS + '32s')
+ALIGN = 8 # every section starts on an 8 byte boundary so it can be cast in place
+SNAPSHOT_EXT = '.rcs'
+
+# Layout (little endian):
+#   header   magic | version | flags | n_hashes | n_postings | (offset,length) x 6 | sha256(body)
+#   meta     JSON: songs, tags, song_tags, similarities
+#   key_offs uint64[n_hashes+1]  -> byte ranges of each hash inside keys
+#   keys     utf-8 hash strings, sorted, concatenated
+#   starts   uint64[n_hashes+1]  -> posting ranges of each hash
+#   songs    uint32[n_postings]
+#   offsets  float64[n_postings]
+
+
+def _pad(n):
+    return (-n) % ALIGN
+
+
+# Write catalog to a single snapshot file
+def export_snapshot(conn,path):
+    cur = conn.cursor()
+
+    meta = {
+        'songs' : cur.execute('SELECT song_id, title, url FROM songs ORDER BY song_id').fetchall(),
+        'tags' : cur.execute('SELECT tag_id, tag_name FROM tags ORDER BY tag_id').fetchall(),
+        'song_tags' : cur.execute('SELECT song_id, tag_id FROM song_tags ORDER BY song_id, tag_id').fetchall(),
+        'similarities' : cur.execute('''
+                                     SELECT song_id1, song_id2, shared_tags FROM song_similarities
+                                     ORDER BY song_id1, shared_tags DESC, song_id2
+                                     ''').fetchall(),
+    }
+
+    cur.execute('SELECT hash, song_id, offset FROM fingerprints ORDER BY hash, song_id, offset')
+
+    return write_postings(path,cur,meta)
+
+
+# Write (hash, song_id, offset) rows sorted by hash (Return no. of postings)
+def write_postings(path,rows,meta = None):
+    key_offs = array('Q',[0])
+    keys = bytearray()
+    starts = array('Q',[0])
+    songs = array('I')
+    offsets = array('d')
+
+    prev = None
+    for h,song_id,offset in rows:
+        if h != prev:
+            if prev is not None:
+                if h < prev:
+                    raise ValueError("Postings must be sorted by hash")
+                key_offs.append(len(keys))
+                starts.append(len(songs))
+            keys += h.encode('utf-8')
+            prev = h
+        songs.append(song_id)
+        offsets.append(offset)
+
+    if prev is not None:
+        key_offs.append(len(keys))
+        starts.append(len(songs))
+    n_hashes = len(key_offs) - 1
+
+    sections = [json.dumps(meta or {},separators=(',',':')).encode('utf-8')]
+    for arr in (key_offs,keys,starts,songs,offsets):
+        if isinstance(arr,array) and sys.byteorder != 'little':
+            arr = array(arr.typecode,arr)
+            arr.byteswap()
+        sections.append(bytes(arr))
+
+    body = bytearray()
+    table = []
+    for data in sections:
+        table.append((HEADER.size + len(body),len(data)))
+        body += data
+        body += b'\x00'*_pad(len(body))
+
+    fields = [f for pair in table for f in pair]
+    header = HEADER.pack(MAGIC,VERSION,0,n_hashes,len(songs),*fields,hashlib.sha256(body).digest())
+
+    # Write next to the target and rename so readers never see a half written file
+    tmp_path = path + '.tmp'
+    with open(tmp_path,'wb') as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path,path)
+
+    return len(songs)
+
+
+class _Keys:
+    # Sorted hash strings viewed as a sequence of bytes (for bisect)
+    def __init__(self,key_offs,keys):
+        self.key_offs = key_offs
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.key_offs) - 1
+
+    def __getitem__(self,i):
+        return bytes(self.keys[self.key_offs[i]:self.key_offs[i+1]])
+
+
+class Snapshot:
+    def __init__(self,path,verify = True):
+        self.path = path
+        self._file = open(path,'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(),0,access = mmap.ACCESS_READ)
+        except ValueError: # empty file
+            self._file.close()
+            raise ValueError(f"{path} is not a snapshot")
+
+        try:
+            self._load(verify)
+        except Exception:
+            self.close()
+            raise
+
+    def _load(self,verify):
+        if len(self._mm) < HEADER.size:
+            raise ValueError(f"{self.path} is not a snapshot")
+
+        magic,version,_,n_hashes,n_postings,*rest = HEADER.unpack_from(self._mm,0)
+        table = list(zip(rest[0:-1:2],rest[1:-1:2]))
+        digest = rest[-1]
+
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a snapshot")
+        if version != VERSION:
+            raise ValueError(f"Unsupported snapshot version {version} (expected {VERSION})")
+        if verify and hashlib.sha256(self._mm[HEADER.size:]).digest() != digest:
+            raise ValueError(f"Checksum mismatch in {self.path}")
+
+        view = memoryview(self._mm)
+        def section(i,typecode = None):
+            off,length = table[i]
+            data = view[off:off+length]
+            if typecode is None:
+                return data
+            if sys.byteorder != 'little': # no zero-copy on big endian hosts
+                arr = array(typecode,bytes(data))
+                arr.byteswap()
+                return arr
+            return data.cast(typecode)
+
+        self.meta = json.loads(bytes(section(0)).decode('utf-8'))
+        self.n_hashes = n_hashes
+        self.n_postings = n_postings
+        self._key_offs = section(1,'Q')
+        self._starts = section(3,'Q')
+        self._songs = section(4,'I')
+        self._offsets = section(5,'d')
+        self._keys = _Keys(self._key_offs,section(2))
+
+        self.songs = {song_id : (title,url) for song_id,title,url in self.meta.get('songs',[])}
+        self.similar = {}
+        for id1,id2,shared in self.meta.get('similarities',[]):
+            self.similar.setdefault(id1,[]).append((id2,shared))
+
+    # Posting range for hash (Return (start,end), empty if absent)
+    def _range(self,hash):
+        key = hash.encode('utf-8')
+        i = bisect_left(self._keys,key)
+        if i < len(self._keys) and self._keys[i] == key:
+            return self._starts[i],self._starts[i+1]
+        return 0,0
+
+    # Find (song_id, offset) for hash
+    def lookup(self,hash):
+        start,end = self._range(hash)
+        return list(zip(self._songs[start:end],self._offsets[start:end]))
+
+    # No. of postings for hash
+    def count(self,hash):
+        start,end = self._range(hash)
+        return end - start
+
+    # All (hash, song_id, offset) rows in hash order
+    def iter_postings(self):
+        for i in range(self.n_hashes):
+            h = self._keys[i].decode('utf-8')
+            for j in range(self._starts[i],self._starts[i+1]):
+                yield h,self._songs[j],self._offsets[j]
+
+    # Get similar songs by tag count (same rows as db.get_top_similar_songs)
+    def get_top_similar_songs(self,song_id,limit = 5):
+        rows = []
+        for id2,shared in self.similar.get(song_id,[]):
+            title,url = self.songs.get(id2,(None,None))
+            rows.append((id2,title,shared,url))
+        rows.sort(key = lambda r : (-r[2],r[1] or ''))
+
+        return rows[:limit]
+
+    def close(self):
+        # Drop exported views before closing the map
+        for name in ('_key_offs','_starts','_songs','_offsets'):
+            arr = getattr(self,name,None)
+            if isinstance(arr,memoryview):
+                arr.release()
+        if hasattr(self,'_keys'):
+            self._keys.keys.release()
+        self._keys = None
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+
+# Open snapshot for querying
+def load_snapshot(path,verify = True):
+    return Snapshot(path,verify = verify)
+
+
+# Replace DB contents with snapshot contents (all or nothing)
+def import_snapshot(conn,path,verify = True):
+    from ingest_log import remove_merged_segments # imports this module
+    from bloom import get_bloom_path, rebuild_bloom
+
+    with load_snapshot(path,verify = verify) as snap:
+        meta = snap.meta
+        try:
+            clear_db(conn,commit = False)
+            cur = conn.cursor()
+            cur.executemany('INSERT INTO songs (song_id,title,url) VALUES (?,?,?)',meta.get('songs',[]))
+            cur.executemany('INSERT INTO tags (tag_id,tag_name) VALUES (?,?)',meta.get('tags',[]))
+            cur.executemany('INSERT INTO song_tags (song_id,tag_id) VALUES (?,?)',meta.get('song_tags',[]))
+            cur.executemany('''
+                            INSERT INTO song_similarities (song_id1,song_id2,shared_tags) VALUES (?,?,?)
+                            ''',meta.get('similarities',[]))
+            cur.executemany('INSERT INTO fingerprints (hash,song_id,offset) VALUES (?,?,?)',snap.iter_postings())
+            rebuild_hash_counts(conn,commit = False)
+            # Stale filter would reject the new hashes: drop it before they are visible
+            try:
+                os.remove(get_bloom_path(get_conn_path(conn)))
+            except FileNotFoundError:
+                pass
+            conn.commit()
+        except BaseException:
+            conn.rollback() # keep the old catalog
+            raise
+        n = snap.n_postings
+
+    remove_merged_segments(conn,get_conn_path(conn))
+    rebuild_bloom(conn)
+
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export / import the catalog as a binary snapshot")
+    sub = parser.add_subparsers(dest='cmd',required=True)
+
+    p_exp = sub.add_parser('export',help="Write DB to snapshot")
+    p_exp.add_argument('path')
+
+    p_imp = sub.add_parser('import',help="Load snapshot into DB (replaces DB contents)")
+    p_imp.add_argument('path')
+    p_imp.add_argument('--no-verify',action='store_true',help="Skip checksum check")
+
+    p_info = sub.add_parser('info',help="Show snapshot summary")
+    p_info.add_argument('path')
+
+    args = parser.parse_args()
+
+    if args.cmd == 'export':
+        from ingest_log import merge_segments # imports this module
+        conn = init_db()
+        merge_segments(conn)
+        n = export_snapshot(conn,args.path)
+        conn.close()
+        print("Exported ",n," postings to ",args.path)
+    elif args.cmd == 'import':
+        conn = init_db()
+        n = import_snapshot(conn,args.path,verify = not args.no_verify)
+        conn.close()
+        print("Imported ",n," postings from ",args.path)
+    else:
+        with load_snapshot(args.path) as snap:
+            print("Version: ",VERSION)
+            print("Songs: ",len(snap.songs))
+            print("Hashes: ",snap.n_hashes)
+            print("Postings: ",snap.n_postings)
+            print("Size: ",os.path.getsize(args.path)," bytes")
@@ -0,0 +1,209 @@
+import os
+import csv
+import time
+import argparse
+import itertools
+import tempfile
+import dataclasses
+import numpy as np
+import librosa
+
+from config import DEFAULT_CONFIG, FingerprintConfig
+from db import init_db, add_song, store_fingerprints
+from fingerprint import fingerprint_audio
+from recognize import find_best_match, get_cache, release_cache
+from ingest_log import get_segments, release_segments
+
+#CONSTANTS
+REF_DIR = os.path.join(os.path.dirname(__file__),'data')
+SNRS = [20,10,0] # dB
+CLIP_LENGTHS = [3,5,10] # seconds
+CLIPS_PER_SONG = 2 # per (SNR, length)
+SEED = 0
+GRID = {
+    'fan_value' : [5,10,15],
+    'amp_threshold' : [-40,-30,-20],
+    'radius' : [5,10],
+}
+OBJECTIVES = { # metric : +1 maximize / -1 minimize
+    'accuracy' : 1,
+    'hashes_per_sec' : 1,
+    'db_bytes_per_song' : -1,
+    'p95_latency_ms' : -1,
+}
+
+
+# "fan_value=5,10" -> ('fan_value', [5, 10])
+def parse_grid_arg(arg):
+    name,values = arg.split('=',1)
+    types = {f.name : f.type for f in dataclasses.fields(FingerprintConfig)}
+    if name not in types:
+        raise argparse.ArgumentTypeError(f"Unknown parameter {name} (one of {', '.join(types)})")
+
+    return name,[types[name](v) for v in values.split(',')]
+
+
+def make_configs(grid):
+    names = list(grid)
+    for values in itertools.product(*(grid[n] for n in names)):
+        yield DEFAULT_CONFIG.with_changes(**dict(zip(names,values)))
+
+
+def list_reference_songs(ref_dir):
+    return sorted(os.path.join(ref_dir,f) for f in os.listdir(ref_dir)
+                  if f.lower().endswith(('.mp3','.wav')))
+
+
+def add_noise(y,snr_db,rng):
+    power = np.mean(y**2)
+    if power == 0:
+        return y
+    noise = rng.normal(0.0,np.sqrt(power / 10**(snr_db/10)),len(y))
+
+    return (y + noise).astype(y.dtype)
+
+
+# Clip positions, identical for every config: [(song idx, start s, length s, SNR, seed)]
+def plan_clips(durations,snrs,lengths,per_song):
+    rng = np.random.default_rng(SEED)
+    plan = []
+    for i,duration in enumerate(durations):
+        for snr,length in itertools.product(snrs,lengths):
+            if length > duration:
+                continue
+            for _ in range(per_song):
+                start = float(rng.uniform(0,duration - length))
+                plan.append((i,start,length,snr,int(rng.integers(2**31))))
+
+    return plan
+
+
+def _db_size(path):
+    return sum(os.path.getsize(p) for p in (path,path + '-wal') if os.path.exists(p))
+
+
+# Ingest reference set and query clips with one config (Return metrics)
+def evaluate(config,songs,plan,audio_cache):
+    if config.sr not in audio_cache:
+        audio_cache[config.sr] = [librosa.load(p,sr = config.sr,mono = True)[0] for p in songs]
+    audio = audio_cache[config.sr]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp,'fingerprints.db')
+        conn = init_db(db_path)
+
+        song_ids = []
+        n_hashes = 0
+        t0 = time.perf_counter()
+        for path,y in zip(songs,audio):
+            hashes = fingerprint_audio(y,config.sr,config)
+            song_id = add_song(conn,os.path.splitext(os.path.basename(path))[0])
+            store_fingerprints(conn,song_id,hashes)
+            song_ids.append(song_id)
+            n_hashes += len(hashes)
+        ingest_time = time.perf_counter() - t0
+
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        db_bytes = _db_size(db_path)
+
+        cache,_ = get_cache(conn,get_segments(conn))
+        latencies = []
+        correct = {}
+        for i,start,length,snr,seed in plan:
+            y = audio[i]
+            a = int(start*config.sr)
+            clip = add_noise(y[a:a + int(length*config.sr)],snr,np.random.default_rng(seed))
+
+            cache.invalidate() # every clip is a cold query
+            t0 = time.perf_counter()
+            song_id,_ = find_best_match(conn,fingerprint_audio(clip,config.sr,config))
+            latencies.append(time.perf_counter() - t0)
+            correct.setdefault(snr,[]).append(song_id == song_ids[i])
+
+        # The temp DB is gone after this config: drop its process-wide state too
+        release_cache(conn)
+        release_segments(conn)
+        conn.close()
+
+    hits = [ok for oks in correct.values() for ok in oks]
+    metrics = {
+        'accuracy' : float(np.mean(hits)) if hits else 0.0,
+        'hashes_per_sec' : n_hashes / ingest_time if ingest_time else 0.0,
+        'hashes_per_song' : n_hashes / len(songs),
+        'db_bytes_per_song' : db_bytes / len(songs),
+        'p95_latency_ms' : float(np.percentile(latencies,95))*1000 if latencies else 0.0,
+    }
+    for snr,oks in sorted(correct.items()):
+        metrics[f'accuracy_snr{snr}'] = float(np.mean(oks))
+
+    return metrics
+
+
+def dominates(a,b):
+    better = False
+    for metric,sign in OBJECTIVES.items():
+        if sign*a[metric] < sign*b[metric]:
+            return False
+        if sign*a[metric] > sign*b[metric]:
+            better = True
+
+    return better
+
+
+# Rows not dominated by any other row
+def pareto_front(rows):
+    return [r for r in rows if not any(dominates(o,r) for o in rows if o is not r)]
+
+
+def sweep(grid,ref_dir = REF_DIR,snrs = SNRS,lengths = CLIP_LENGTHS,per_song = CLIPS_PER_SONG,out_path = None):
+    songs = list_reference_songs(ref_dir)
+    if not songs:
+        print("No reference songs in ",ref_dir)
+        return []
+
+    durations = [librosa.get_duration(path = p) for p in songs]
+    plan = plan_clips(durations,snrs,lengths,per_song)
+    audio_cache = {}
+    rows = []
+
+    configs = list(make_configs(grid))
+    print(f"{len(songs)} songs, {len(plan)} clips, {len(configs)} configs")
+    for k,config in enumerate(configs,1):
+        metrics = evaluate(config,songs,plan,audio_cache)
+        rows.append({**config.to_dict(),**metrics})
+        print(f"[{k}/{len(configs)}] " + ' '.join(f"{n}={getattr(config,n)}" for n in grid) +
+              f"  acc={metrics['accuracy']:.1%}  p95={metrics['p95_latency_ms']:.0f}ms")
+
+    front = pareto_front(rows)
+    for r in rows:
+        r['pareto'] = any(r is f for f in front)
+
+    if out_path:
+        with open(out_path,'w',newline='',encoding='utf-8') as f:
+            writer = csv.DictWriter(f,fieldnames = list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        print("Saved to ",out_path)
+
+    print("\nPareto front:")
+    print(f"{'accuracy':>9}{'hash/s':>10}{'hash/song':>11}{'KB/song':>9}{'p95 ms':>8}  config")
+    for r in sorted(front,key = lambda r : -r['accuracy']):
+        params = ', '.join(f"{n} = {r[n]}" for n in grid)
+        print(f"{r['accuracy']:>9.1%}{r['hashes_per_sec']:>10.0f}{r['hashes_per_song']:>11.0f}"
+              f"{r['db_bytes_per_song']/1024:>9.0f}{r['p95_latency_ms']:>8.0f}  {params}")
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep fingerprint constants over a reference set")
+    parser.add_argument('grid',nargs='*',type=parse_grid_arg,
+                        help="name=v1,v2,... (default: " + ' '.join(f"{k}={','.join(map(str,v))}" for k,v in GRID.items()) + ")")
+    parser.add_argument('--ref-dir',default=REF_DIR,help="Folder with reference .mp3/.wav files")
+    parser.add_argument('--snr',type=int,nargs='+',default=SNRS,help="Clip SNRs in dB")
+    parser.add_argument('--lengths',type=float,nargs='+',default=CLIP_LENGTHS,help="Clip lengths in s")
+    parser.add_argument('--clips',type=int,default=CLIPS_PER_SONG,help="Clips per song, SNR and length")
+    parser.add_argument('--out',default='sweep_results.csv')
+    args = parser.parse_args()
+
+    sweep(dict(args.grid) or GRID,args.ref_dir,args.snr,args.lengths,args.clips,args.out)
@@ -4,19 +4,14 @@ import numpy as np
 import librosa 
 import matplotlib.pyplot as plt
 
-#CONSTANTS
-SR = 22050
-N_FFT = 4096
-HOP_LENGTH = 512
-N_BANDS = 5
-AMP_THRESHOLD = -30 # dB
-RADIUS = 10 # For Pruning
-
-def plot(S_db,freqs,times,peaks,save_path = None):
+from config import DEFAULT_CONFIG
+
+
+def plot(S_db,freqs,times,peaks,save_path = None,config = DEFAULT_CONFIG):
     plt.figure(figsize=(10,6))
 
     librosa.display.specshow(
-        S_db, sr = SR, hop_length= HOP_LENGTH, x_axis = 'time', y_axis = 'log', cmap = 'viridis'
+        S_db, sr = config.sr, hop_length= config.hop_length, x_axis = 'time', y_axis = 'log', cmap = 'viridis'
     )
 
     plt.colorbar(format='%+2.0f dB')
@@ -46,7 +41,7 @@ def plot(S_db,freqs,times,peaks,save_path = None):
         plt.show()
 
 
-def prune(peaks,S_db):
+def prune(peaks,S_db,config = DEFAULT_CONFIG):
     if len(peaks) == 0:
         return []
     
@@ -56,24 +51,25 @@ def prune(peaks,S_db):
     final = []
 
     occupied = np.zeros_like(S_db,dtype=bool) # Mask to mark occupied freq-time region (prune out weaker close by peaks)
+    radius = config.radius
 
     for i in sort_amps:
         f,t = peaks[i]
         if not occupied[f,t]:
             final.append((f,t))
 
-            f_start = max(0,f-RADIUS)
-            t_start = max(0,t-RADIUS)
+            f_start = max(0,f-radius)
+            t_start = max(0,t-radius)
 
-            f_end = min(S_db.shape[0], f + RADIUS + 1) # end idx excl.
-            t_end = min(S_db.shape[1],t + RADIUS + 1)
+            f_end = min(S_db.shape[0], f + radius + 1) # end idx excl.
+            t_end = min(S_db.shape[1],t + radius + 1)
 
             occupied[f_start:f_end,t_start:t_end] = True
 
     return final
 
 
-def find_peaks(S_db,freqs):
+def find_peaks(S_db,freqs,config = DEFAULT_CONFIG):
     n_times = S_db.shape[1]
 
     # To avoid log(0) errors
@@ -83,11 +79,11 @@ def find_peaks(S_db,freqs):
 
     log_freqs = np.log10(ffreqs)
 
-    # Divide into N_BANDS bands 
+    # Divide into n_bands bands 
     bands = []
-    edges = np.linspace(log_freqs[0],log_freqs[-1],N_BANDS+1)
+    edges = np.linspace(log_freqs[0],log_freqs[-1],config.n_bands+1)
 
-    for i in range(5):
+    for i in range(config.n_bands):
         band_idx = np.where((log_freqs>=edges[i]) & (log_freqs<edges[i+1]))[0]
         bands.append(band_idx)
     
@@ -103,34 +99,38 @@ def find_peaks(S_db,freqs):
             
             freq_idx = band_idx[max_idx] # map local to global
 
-            if S_db[freq_idx,t] >= AMP_THRESHOLD:
+            if S_db[freq_idx,t] >= config.amp_threshold:
                 peaks.append((freq_idx,t))
     
     return peaks
     
 
-def get_spectrogram(y, sr):
-    stft = librosa.stft(y,n_fft=N_FFT,hop_length=HOP_LENGTH)
+def get_spectrogram(y, sr, config = DEFAULT_CONFIG):
+    stft = librosa.stft(y,n_fft=config.n_fft,hop_length=config.hop_length)
     magnitude = np.abs(stft)
 
     S_db = librosa.amplitude_to_db(magnitude,ref = np.max)
 
-    freqs = librosa.fft_frequencies(sr = sr,n_fft= N_FFT)
+    freqs = librosa.fft_frequencies(sr = sr,n_fft= config.n_fft)
 
     n_times = S_db.shape[1]
     frame_indices = np.arange(n_times)
 
-    times = librosa.frames_to_time(frame_indices,sr = sr,hop_length= HOP_LENGTH)
+    times = librosa.frames_to_time(frame_indices,sr = sr,hop_length= config.hop_length)
 
     return S_db, freqs, times
 
 
-def load_audio(file_path):
-    y, sr = librosa.load(file_path,sr = SR, mono = True)
+def load_audio(file_path,config = DEFAULT_CONFIG,offset = 0.0,duration = None):
+    y, sr = librosa.load(file_path,sr = config.sr, mono = True, offset = offset, duration = duration)
     
     return y ,sr
 
 
+def get_audio_duration(file_path):
+    return librosa.get_duration(path = file_path)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("audio_path")